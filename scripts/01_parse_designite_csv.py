@@ -6,9 +6,11 @@ Expected columns (case-insensitive, flexible spacing):
   Project Name | Package Name | Type Name | Design Smell | Cause of the Smell
 Outputs:
   data/interim/smells.parquet
-  data/interim/smells.csv
+  data/interim/smells.csv        (only with --debug)
+--engine polars runs the same transforms on Polars (optional dependency:
+pip install polars) and converts to pandas only for writing.
 """
-import argparse, hashlib, json, os, re, sys
+import argparse, csv, hashlib, json
 from pathlib import Path
 import pandas as pd
 
@@ -20,17 +22,43 @@ COLMAP = {
     "cause of the smell": "detector_reason",
 }
 
+# Fastest parser first: pyarrow (multi-threaded), then pandas' C tokenizer.
+# The pure-Python engine is only a last resort for pathological separators/quoting.
+READ_ENGINES = ("pyarrow", "c", "python")
+
+def read_with_pyarrow(path: Path, sep: str) -> pd.DataFrame:
+    # pandas' engine="pyarrow" infers types and casts back even with dtype=str
+    # ("007" -> "7", "25" -> "25.0" next to a blank); type every column as string up front
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        names = next(csv.reader(f, delimiter=sep))
+    table = pacsv.read_csv(path, parse_options=pacsv.ParseOptions(delimiter=sep),
+                           convert_options=pacsv.ConvertOptions(
+                               column_types={n: pa.string() for n in names}, strings_can_be_null=True))
+    return table.to_pandas()
+
+def read_delimited(path: Path, sep: str = ",") -> pd.DataFrame:
+    err = None
+    for engine in READ_ENGINES:
+        try:
+            if engine == "pyarrow":
+                return read_with_pyarrow(path, sep)
+            return pd.read_csv(path, sep=sep, dtype=str, engine=engine)
+        except Exception as e:  # ImportError (no pyarrow) or parse failure
+            err = e
+    raise err
+
 def smart_read_table(path: Path) -> pd.DataFrame:
     # Try CSV then TSV then Excel
     try:
-        df = pd.read_csv(path, dtype=str, engine="python")
+        df = read_delimited(path)
         if df.shape[1] == 1:
             raise ValueError("single column CSV—likely TSV")
         return df
     except Exception:
         try:
-            df = pd.read_csv(path, sep="\t", dtype=str, engine="python")
-            return df
+            return read_delimited(path, sep="\t")
         except Exception:
             return pd.read_excel(path, dtype=str)
 
@@ -46,7 +74,7 @@ def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
         raise SystemExit(f"Missing expected columns: {missing}. Got: {list(df.columns)}")
     # Trim whitespace
     for c in out.columns:
-        if out[c].dtype == object:
+        if pd.api.types.is_string_dtype(out[c].dtype):   # object, or pandas' str dtype
             out[c] = out[c].astype(str).str.strip()
     return out[list(COLMAP.values())]
 
@@ -60,50 +88,101 @@ METRIC_PATTERNS = {
     "NAD": r"\bNAD\s*\(?([0-9]+)\)?",
 }
 
-def extract_metrics(text: str) -> dict:
-    m = {}
-    if not isinstance(text, str): 
-        return m
-    for k, pat in METRIC_PATTERNS.items():
-        r = re.search(pat, text)
-        if r:
-            try:
-                m[k] = float(r.group(1)) if "." in r.group(1) else int(r.group(1))
-            except Exception:
-                pass
-    return m
-
-def make_case_id(row) -> str:
-    h = hashlib.sha1(f"{row['project']}|{row['package']}|{row['class_name']}|{row['smell_type']}|{row['detector_reason']}".encode()).hexdigest()[:12]
-    return f"{row['project'].replace(' ','_')}_{h}"
+def metrics_json(found: list[dict]) -> list[str]:
+    # one JSON object per row, holding only the metrics that matched
+    def as_number(v: str):
+        return float(v) if "." in v else int(v)
+    return [json.dumps({k: as_number(v) for k, v in rec.items() if isinstance(v, str)}) for rec in found]
+
+def short_hashes(keys: list[str]) -> list[str]:
+    return [hashlib.sha1(k.encode()).hexdigest()[:12] for k in keys]
+
+def extract_metrics(reasons: pd.Series) -> pd.Series:
+    """
+    Vectorized metric extraction: one C-level str.extract pass per pattern,
+    then a single JSON serialization per row (only of the metrics found).
+    """
+    found = pd.concat(
+        {k: reasons.str.extract(pat, expand=False) for k, pat in METRIC_PATTERNS.items()},
+        axis=1,
+    )
+    return pd.Series(metrics_json(found.to_dict(orient="records")), index=reasons.index)
+
+def make_case_ids(df: pd.DataFrame) -> pd.Series:
+    # join the key columns column-wise, then hash in a plain list comprehension (no per-row Series)
+    # na_rep: empty cells hash as "nan", as the old per-row f-string did
+    keys = df["project"].str.cat(
+        [df["package"], df["class_name"], df["smell_type"], df["detector_reason"]], sep="|", na_rep="nan"
+    )
+    hashes = pd.Series(short_hashes(keys.tolist()), index=df.index)
+    return df["project"].str.replace(" ", "_", regex=False) + "_" + hashes
+
+def parse_with_pandas(inp: Path) -> pd.DataFrame:
+    df = smart_read_table(inp)
+    df = normalize_columns(df)
+
+    # metrics JSON
+    df["metrics"] = extract_metrics(df["detector_reason"])
+    df["case_id"] = make_case_ids(df)
+
+    # Preserve inner-class names; also compute outer type for file resolution
+    df["outer_class"] = df["class_name"].str.split(".", n=1, expand=True)[0]
+    df["inner_class"] = df["class_name"].where(df["class_name"].str.contains(".", regex=False), other=None)
+    return df
+
+def parse_with_polars(inp: Path) -> pd.DataFrame:
+    """Same output as parse_with_pandas, computed on Polars' multi-threaded engine."""
+    import polars as pl
+
+    if inp.suffix.lower() in (".xlsx", ".xls"):
+        raw = pl.from_pandas(pd.read_excel(inp, dtype=str))
+    else:
+        raw = pl.read_csv(inp, infer_schema=False)
+        if raw.width == 1:
+            raw = pl.read_csv(inp, separator="\t", infer_schema=False)
+
+    cols = {c.strip().lower(): c for c in raw.columns}
+    missing = [v for k, v in COLMAP.items() if k not in cols]
+    if missing:
+        raise SystemExit(f"Missing expected columns: {missing}. Got: {raw.columns}")
+    df = raw.select(pl.col(cols[k]).str.strip_chars().alias(v) for k, v in COLMAP.items())
+
+    found = df.select(
+        pl.col("detector_reason").str.extract(pat, 1).alias(k) for k, pat in METRIC_PATTERNS.items()
+    )
+    keys = df.select(
+        pl.concat_str(
+            [pl.col(c).fill_null("nan") for c in ("project", "package", "class_name", "smell_type", "detector_reason")],
+            separator="|",
+        )
+    ).to_series()
+    df = df.with_columns(
+        metrics=pl.Series(metrics_json(found.rows(named=True)), dtype=pl.String),
+        case_id=pl.col("project").str.replace_all(" ", "_", literal=True) + "_"
+                + pl.Series(short_hashes(keys.to_list()), dtype=pl.String),
+        outer_class=pl.col("class_name").str.split_exact(".", 1).struct.field("field_0"),
+        inner_class=pl.when(pl.col("class_name").str.contains(".", literal=True))
+                      .then(pl.col("class_name")),
+    )
+    return df.to_pandas()
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--input", required=True, help="Path to DesigniteJava smell CSV/TSV/XLSX")
     ap.add_argument("--outdir", default="data/interim", help="Output directory")
+    ap.add_argument("--debug", action="store_true", help="Also write a CSV copy for inspection")
+    ap.add_argument("--engine", choices=["pandas", "polars"], default="pandas")
     args = ap.parse_args()
 
     inp = Path(args.input)
     outdir = Path(args.outdir); outdir.mkdir(parents=True, exist_ok=True)
 
-    df = smart_read_table(inp)
-    df = normalize_columns(df)
+    df = parse_with_polars(inp) if args.engine == "polars" else parse_with_pandas(inp)
 
-    # metrics JSON
-    df["metrics"] = df["detector_reason"].apply(extract_metrics).apply(json.dumps)
-    df["case_id"] = df.apply(make_case_id, axis=1)
-
-    # Preserve inner-class names; also compute outer type for file resolution
-    def split_inner(name: str):
-        return (name.split(".")[0], name if "." in name else None)
-    df[["outer_class","inner_class"]] = df["class_name"].apply(lambda s: pd.Series(split_inner(s)))
-
-    # Save
-    df.to_csv(outdir / "smells.csv", index=False)
-    try:
-        df.to_parquet(outdir / "smells.parquet", index=False)
-    except Exception:
-        pass
+    # Save: Parquet is the canonical hand-off to the next step
+    df.to_parquet(outdir / "smells.parquet", index=False, engine="pyarrow", compression="snappy")
+    if args.debug:
+        df.to_csv(outdir / "smells.csv", index=False)
 
     print(f"Saved {len(df)} rows to {outdir}")
     print(df.head(3).to_string(index=False))
@@ -3,53 +3,120 @@
 """
 Merge Designite metrics with smell detections.
 Inputs:
-  data/interim/smells.csv         (from parse_designite_csv.py)
+  data/interim/smells.parquet     (from parse_designite_csv.py; a .csv also works)
   --metrics_csv path/to/metrics.csv  (Designite metrics export; CSV/TSV/XLSX)
 Outputs:
-  data/interim/smells_with_metrics.csv
-  data/interim/smells_with_metrics.parquet (best-effort)
+  data/interim/smells_with_metrics.parquet
+  data/interim/smells_with_metrics.csv     (only with --debug)
+--engine polars does the read + join on Polars (optional dependency:
+pip install polars) and converts to pandas only for writing.
 """
-import argparse
+import argparse, csv
 import pandas as pd
 from pathlib import Path
 
+# Fastest parser first: pyarrow (multi-threaded), then pandas' C tokenizer.
+# The pure-Python engine is only a last resort for pathological separators/quoting.
+READ_ENGINES = ("pyarrow", "c", "python")
+
+def read_with_pyarrow(path: Path, sep: str) -> pd.DataFrame:
+    # pandas' engine="pyarrow" infers types and casts back even with dtype=str
+    # ("007" -> "7", "25" -> "25.0" next to a blank); type every column as string up front
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        names = next(csv.reader(f, delimiter=sep))
+    table = pacsv.read_csv(path, parse_options=pacsv.ParseOptions(delimiter=sep),
+                           convert_options=pacsv.ConvertOptions(
+                               column_types={n: pa.string() for n in names}, strings_can_be_null=True))
+    return table.to_pandas()
+
+def read_delimited(path: Path, sep: str = ",") -> pd.DataFrame:
+    err = None
+    for engine in READ_ENGINES:
+        try:
+            if engine == "pyarrow":
+                return read_with_pyarrow(path, sep)
+            return pd.read_csv(path, sep=sep, dtype=str, engine=engine)
+        except Exception as e:  # ImportError (no pyarrow) or parse failure
+            err = e
+    raise err
+
 def smart_read_table(path: Path) -> pd.DataFrame:
     try:
-        return pd.read_csv(path, dtype=str, engine="python")
+        return read_delimited(path)
     except Exception:
         try:
-            return pd.read_csv(path, sep="\t", dtype=str, engine="python")
+            return read_delimited(path, sep="\t")
         except Exception:
             return pd.read_excel(path, dtype=str)
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--smells_csv", default="data/interim/smells.csv")
-    ap.add_argument("--metrics_csv", required=True)
-    ap.add_argument("--out_csv", default="data/interim/smells_with_metrics.csv")
-    args = ap.parse_args()
+def read_smells(path: Path) -> pd.DataFrame:
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path, engine="pyarrow")
+    return read_delimited(path)
+
+KEYS = ["Project Name","Package Name","Type Name"]
+RENAME = {"project":"Project Name","package":"Package Name","class_name":"Type Name"}
 
-    smells = pd.read_csv(args.smells_csv, dtype=str)
-    metrics = smart_read_table(Path(args.metrics_csv))
+def merge_with_pandas(smells_path: Path, metrics_path: Path) -> pd.DataFrame:
+    smells = read_smells(smells_path)
+    metrics = smart_read_table(metrics_path)
 
     # normalize names for join
-    smells = smells.rename(columns={"project":"Project Name","package":"Package Name","class_name":"Type Name"})
-    for c in ["Project Name","Package Name","Type Name"]:
+    smells = smells.rename(columns=RENAME)
+    for c in KEYS:
         smells[c] = smells[c].astype(str).str.strip()
         metrics[c] = metrics[c].astype(str).str.strip()
 
-    merged = pd.merge(smells, metrics, on=["Project Name","Package Name","Type Name"], how="left", suffixes=("",""))
+    # index-aligned left join on the composite key (smell row order preserved)
+    merged = smells.set_index(KEYS).join(metrics.set_index(KEYS), how="left").reset_index()
+    return merged[list(smells.columns) + [c for c in metrics.columns if c not in KEYS]]
+
+def merge_with_polars(smells_path: Path, metrics_path: Path) -> pd.DataFrame:
+    """Same left join on Polars' multi-threaded engine."""
+    import polars as pl
+
+    def read(path: Path) -> "pl.DataFrame":
+        if path.suffix == ".parquet":
+            return pl.read_parquet(path)
+        if path.suffix.lower() in (".xlsx", ".xls"):
+            return pl.from_pandas(pd.read_excel(path, dtype=str))
+        df = pl.read_csv(path, infer_schema=False)
+        return df if df.width > 1 else pl.read_csv(path, separator="\t", infer_schema=False)
+
+    smells = read(smells_path).rename(RENAME)
+    metrics = read(metrics_path)
+    # nulls_equal: missing keys match each other, as in the pandas index join
+    strip = [pl.col(c).cast(pl.String).str.strip_chars() for c in KEYS]
+    merged = smells.with_columns(strip).join(
+        metrics.with_columns(strip), on=KEYS, how="left", maintain_order="left", nulls_equal=True
+    )
+    return merged.to_pandas()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--smells", "--smells_csv", dest="smells", default="data/interim/smells.parquet")
+    ap.add_argument("--metrics_csv", required=True)
+    ap.add_argument("--out", default="data/interim/smells_with_metrics.parquet")
+    ap.add_argument("--debug", action="store_true", help="Also write a CSV copy for inspection")
+    ap.add_argument("--engine", choices=["pandas", "polars"], default="pandas")
+    args = ap.parse_args()
+
+    merge = merge_with_polars if args.engine == "polars" else merge_with_pandas
+    merged = merge(Path(args.smells), Path(args.metrics_csv))
 
     # restore canonical columns
-    merged = merged.rename(columns={"Project Name":"project","Package Name":"package","Type Name":"class_name"})
-    Path(args.out_csv).parent.mkdir(parents=True, exist_ok=True)
-    merged.to_csv(args.out_csv, index=False)
-    try:
-        merged.to_parquet(args.out_csv.replace(".csv",".parquet"), index=False)
-    except Exception:
-        pass
+    merged = merged.rename(columns={v: k for k, v in RENAME.items()})
+    # 'Line no' stays as read: 03 keeps only all-digit cells, as the old isdigit() check did
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    merged.to_parquet(out, index=False, engine="pyarrow", compression="snappy")
+    if args.debug:
+        merged.to_csv(out.with_suffix(".csv"), index=False)
 
-    print(f"Merged rows: {len(merged)} -> {args.out_csv}")
+    print(f"Merged rows: {len(merged)} -> {out}")
     print(merged.head(3).to_string(index=False))
 
 if __name__ == "__main__":
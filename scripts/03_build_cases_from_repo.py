@@ -8,25 +8,46 @@ Improved builder:
 - No more smell-specific heuristics needed for excerpt.
 
 Input:
-  smells.csv (must contain: project, package, class_name, outer_class, inner_class, smell_type, detector_reason, Line no)
+  smells_with_metrics.parquet or .csv (must contain: project, package, class_name, outer_class, inner_class, smell_type, detector_reason, Line no)
   --repo_dir /path/to/K-9
 
 Output:
   cases.jsonl (LLM-ready)
 """
 
-import argparse, json, re
+import argparse, bisect, functools, itertools, json, os, re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import orjson
 import pandas as pd
 
-
 # --------------------------------------------------------------------
 # File resolution
 # --------------------------------------------------------------------
-def find_java_file(repo_dir: Path, package: str, outer_class: str) -> Path | None:
-    rel_path = Path(*package.split(".")) / f"{outer_class}.java"
-    candidates = list(repo_dir.rglob(str(rel_path)))
-    return candidates[0] if candidates else None
+def build_java_index(repo_dir: Path) -> dict[tuple[str, str], Path]:
+    """
+    Walks the repo once (os.walk) and maps (package, outer_class) -> .java file.
+    Every trailing run of directory names is indexed as a candidate package,
+    so lookups match what a per-row rglob("<pkg/path>/<Outer>.java") found.
+    That rglob's first hit wins on duplicates: it lists hits by the directory
+    the package path hangs off (dirs[:i]), so one rooted above another wins,
+    else walk order.
+    """
+    best = {}
+    for dirpath, _, filenames in os.walk(repo_dir):
+        rel = os.path.relpath(dirpath, repo_dir)
+        dirs = () if rel == os.curdir else tuple(rel.split(os.sep))
+        for fn in filenames:
+            if not fn.endswith(".java"):
+                continue
+            stem, path = os.path.splitext(fn)[0], None
+            for i in range(len(dirs) + 1):
+                key = (".".join(dirs[i:]), stem)
+                prev = best.get(key)
+                if prev is None or (i < prev[0] and prev[1][:i] == dirs[:i]):
+                    path = path or Path(dirpath, fn)   # a Path only for files that get indexed
+                    best[key] = (i, dirs, path)
+    return {key: p for key, (_, _, p) in best.items()}
 
 
 def read_text(p: Path) -> str:
@@ -36,17 +57,39 @@ def read_text(p: Path) -> str:
         return p.read_text(encoding="latin-1")
 
 
+def line_table(text: str) -> tuple[list[str], list[int]]:
+    """Lines (as splitlines) plus each line's start offset in text."""
+    lines = text.splitlines()
+    starts = list(itertools.accumulate((len(l) for l in text.splitlines(keepends=True)), initial=0))
+    return lines, starts
+
+
+def load_source(path: str) -> tuple[str, list[str], list[int]]:
+    # Called once per file: main groups the smells of a file into one job.
+    text = read_text(Path(path))
+    return (text, *line_table(text))
+
+
 # --------------------------------------------------------------------
 # Class block extractor (inner or outer class)
 # --------------------------------------------------------------------
-def extract_class_block(text: str, start_line: int, class_name: str, loc_limit: int = 400) -> str:
+@functools.lru_cache(maxsize=4096)
+def header_pattern(simple_name: str) -> re.Pattern:
+    # Many smells share a class; compile its header regex once.
+    return re.compile(rf"\b(class|interface|enum)\s+{re.escape(simple_name)}\b")
+
+
+def extract_class_block(text: str, start_line: int, class_name: str, loc_limit: int = 400,
+                        lines: list[str] | None = None, line_starts: list[int] | None = None) -> str:
     """
     Extracts the entire inner class (or outer class) containing the smell
     by:
       - locating the class header near the Designite-reported line
       - brace-matching until the class ends
+    `lines`/`line_starts` may be passed in precomputed (see load_source).
     """
-    lines = text.splitlines()
+    if lines is None or line_starts is None:
+        lines, line_starts = line_table(text)
     n = len(lines)
     if start_line < 1 or start_line > n:
         return "\n".join(lines[:loc_limit])
@@ -55,7 +98,7 @@ def extract_class_block(text: str, start_line: int, class_name: str, loc_limit:
     simple_name = class_name.split(".")[-1]
 
     # Search nearby for class header: class|interface|enum <simple_name>
-    header_pat = re.compile(rf"\b(class|interface|enum)\s+{re.escape(simple_name)}\b")
+    header_pat = header_pattern(simple_name)
     header_idx = None
 
     # Search from start_idx upward slightly and downward
@@ -85,20 +128,22 @@ def extract_class_block(text: str, start_line: int, class_name: str, loc_limit:
     opened = False
     end_idx = None
 
-    # Concatenate lines starting at header_idx
-    for rel_line_idx in range(header_idx, n):
-        line = lines[rel_line_idx]
-        for ch in line:
-            if ch == "{":
-                depth += 1
-                opened = True
-            elif ch == "}":
-                depth -= 1
-                if opened and depth == 0:
-                    end_idx = rel_line_idx
-                    break
-        if end_idx is not None:
+    # Jump brace to brace with str.find from the header line on, instead of
+    # visiting every character; map the closing offset back to its line.
+    pos = line_starts[header_idx]
+    next_open = text.find("{", pos)
+    next_close = text.find("}", pos)
+    while next_close != -1:
+        if next_open != -1 and next_open < next_close:
+            depth += 1
+            opened = True
+            next_open = text.find("{", next_open + 1)
+            continue
+        depth -= 1
+        if opened and depth == 0:
+            end_idx = bisect.bisect_right(line_starts, next_close) - 1
             break
+        next_close = text.find("}", next_close + 1)
 
     # If class end not found → fallback
     if end_idx is None:
@@ -117,67 +162,115 @@ def extract_class_block(text: str, start_line: int, class_name: str, loc_limit:
     return "\n".join(excerpt_lines)
 
 
+# --------------------------------------------------------------------
+# Per-file case building (runs in worker processes)
+# --------------------------------------------------------------------
+def build_file_cases(job: tuple[str, list[tuple[int, dict]], int]) -> list[tuple[int, bytes]]:
+    """
+    Builds the cases for every smell row that resolves to one Java file.
+    Returns (row position, UTF-8 JSON line) pairs so the caller can restore input order.
+    """
+    path, rows, loc_limit = job
+    code, lines, line_starts = load_source(path)
+    out = []
+    for pos, r in rows:
+        excerpt = extract_class_block(
+            text=code,
+            start_line=r["Line no"],
+            class_name=r["class_name"],
+            loc_limit=loc_limit,
+            lines=lines,
+            line_starts=line_starts
+        )
+
+        # Build metrics dictionary (already normalized by your pipeline)
+        try:
+            metrics = json.loads(r.get("metrics", "{}"))
+        except Exception:
+            metrics = {}
+
+        obj = {
+            "case_id": r["case_id"],
+            "project": r["project"],
+            "file_path": path,
+            "package": r["package"],
+            "class_name": r["class_name"],
+            "smell_type": r["smell_type"],
+            "detector_reason": r["detector_reason"],
+            "metrics": metrics,
+            "code_excerpt": excerpt,
+            "excerpt_strategy": "line_based_class_block"
+        }
+        out.append((pos, orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)))
+    return out
+
+
 # --------------------------------------------------------------------
 # Main
 # --------------------------------------------------------------------
+def read_smells(path: Path) -> pd.DataFrame:
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path, engine="pyarrow")
+    return pd.read_csv(path, dtype=str)
+
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--smells_csv", default="data/interim/smells.csv")
+    ap.add_argument("--smells", "--smells_csv", dest="smells", default="data/interim/smells_with_metrics.parquet")
     ap.add_argument("--repo_dir", required=True)
     ap.add_argument("--out", default="data/cases/cases.jsonl")
     ap.add_argument("--loc_limit", type=int, default=400)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                    help="Worker processes for case building (1 = run in-process)")
     args = ap.parse_args()
 
-    df = pd.read_csv(args.smells_csv, dtype=str)
+    df = read_smells(Path(args.smells))
     repo_dir = Path(args.repo_dir)
     out_path = Path(args.out)
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    n_written = 0
-
-    with out_path.open("w", encoding="utf-8") as fout:
-        for _, r in df.iterrows():
-
-            if "Line no" not in r or not str(r["Line no"]).isdigit():
-                continue
-
-            start_line = int(r["Line no"])
-            java_path = find_java_file(repo_dir, r["package"], r["outer_class"])
-            if not java_path or not java_path.exists():
-                continue
-
-            code = read_text(java_path)
-            excerpt = extract_class_block(
-                text=code,
-                start_line=start_line,
-                class_name=r["class_name"],
-                loc_limit=args.loc_limit
-            )
-
-            # Build metrics dictionary (already normalized by your pipeline)
-            try:
-                metrics = json.loads(r.get("metrics", "{}"))
-            except Exception:
-                metrics = {}
-
-            obj = {
-                "case_id": r["case_id"],
-                "project": r["project"],
-                "file_path": str(java_path),
-                "package": r["package"],
-                "class_name": r["class_name"],
-                "smell_type": r["smell_type"],
-                "detector_reason": r["detector_reason"],
-                "metrics": metrics,
-                "code_excerpt": excerpt,
-                "excerpt_strategy": "line_based_class_block"
-            }
-
-            fout.write(json.dumps(obj, ensure_ascii=False) + "\n")
-            n_written += 1
-
-    print(f"Wrote {n_written} cases → {out_path}")
+    # Only rows with a numeric Designite line and a resolvable file can be
+    # located; filter once, not per row, so the loop can trust these columns.
+    # Same rule as the old str(...).isdigit() check: string cells must be all
+    # digits ("3.5", "-4", "12.0", "1e3" are dropped), typed Parquet values whole and >= 0
+    if "Line no" not in df.columns:
+        df["Line no"] = pd.NA   # nothing to locate
+    line_no = df["Line no"]
+    if not pd.api.types.is_numeric_dtype(line_no):
+        line_no = line_no.where(line_no.astype(str).str.fullmatch(r"\d+", na=False))
+    line_no = pd.to_numeric(line_no, errors="coerce")
+    # clip: past-the-end lines must not wrap in the int32 cast (they get the whole-file fallback)
+    df["Line no"] = line_no.where((line_no >= 0) & (line_no % 1 == 0)).clip(upper=2**31 - 1)
+    df = df.dropna(subset=["Line no", "package", "outer_class"]).astype({"Line no": "int32"})
+
+    # One walk of the source tree instead of an rglob per smell row
+    java_index = build_java_index(repo_dir)
+
+    # Group rows by resolved file so each worker reads/splits a file once;
+    # plain dicts instead of iterrows(): no per-row Series construction
+    by_file = {}
+    for pos, r in enumerate(df.to_dict(orient="records")):
+        java_path = java_index.get((r["package"], r["outer_class"]))
+        if not java_path:
+            continue
+        by_file.setdefault(str(java_path), []).append((pos, r))
+    jobs = [(path, rows, args.loc_limit) for path, rows in by_file.items()]
+
+    if args.workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            results = list(ex.map(build_file_cases, jobs, chunksize=8))
+    else:
+        results = [build_file_cases(job) for job in jobs]
+
+    # Write from the main process, in input row order; lines are already
+    # encoded, so a large binary buffer turns them into few big writes
+    records = sorted(itertools.chain.from_iterable(results))
+    with out_path.open("wb", buffering=1 << 20) as fout:
+        for _, line in records:
+            fout.write(line)
+
+    print(f"Wrote {len(records)} cases → {out_path}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -5,18 +5,74 @@ Batch runner using llama.cpp python bindings.
 Requires: pip install llama-cpp-python
 Provide --model_path to the GGUF file on disk.
 """
-import argparse, json, time, hashlib
+import argparse, os, time
 from pathlib import Path
+import orjson
 import yaml
+import xxhash
 from llama_cpp import Llama
 
-def sha1(x): return hashlib.sha1(x.encode()).hexdigest()[:10]
+def prompt_hash(rendered: list[str], settings: dict) -> str:
+    # Cache key over the exact request (system text, prompt text, sampling settings),
+    # so changing any of them regenerates the case on resume.
+    h = xxhash.xxh3_64(orjson.dumps(settings, option=orjson.OPT_SORT_KEYS))
+    for p in rendered:
+        h.update(p.encode())
+    return h.hexdigest()[:10]
 
 def read_cases(p: Path):
-    with p.open() as f:
+    with p.open("rb") as f:
         for line in f:
             if line.strip():
-                yield json.loads(line)
+                yield orjson.loads(line)
+
+def load_done(out_path: Path) -> set:
+    # (case_id, prompt_hash) pairs already in the output; a rerun only does what is missing
+    done = set()
+    if out_path.exists():
+        with out_path.open("rb") as f:
+            for line in f:
+                try:
+                    rec = orjson.loads(line)
+                except orjson.JSONDecodeError:   # blank or truncated line from an interrupted run
+                    continue
+                done.add((rec["case_id"], rec.get("prompt_hash")))
+    return done
+
+def trim_partial_line(out_path: Path) -> None:
+    # An interrupted run can leave a half-written last record; cut it back to the
+    # last newline so the next append starts on a fresh line. A complete record
+    # that only lacks its newline (e.g. a hand-concatenated file) is kept.
+    if not out_path.exists():
+        return
+    with out_path.open("r+b") as f:
+        end = f.seek(0, 2)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - (1 << 16))
+            f.seek(start)
+            chunk = f.read(pos - start)
+            nl = chunk.rfind(b"\n")
+            if nl >= 0:
+                pos = start + nl + 1
+                break
+            pos = start
+        if pos == end:
+            return
+        f.seek(pos)
+        try:
+            orjson.loads(f.read())
+        except orjson.JSONDecodeError:
+            f.truncate(pos)
+        else:
+            f.write(b"\n")
+
+def render_prompt(prompts: dict, key: str, vars: dict) -> str:
+    # Shared case context first, task text last: the templates of a case then
+    # share a prompt prefix the server can cache (see context_template in prompts.yaml).
+    context = prompts.get("context_template")
+    template = f"{context}\n{prompts[key]}" if context else prompts[key]
+    return template.format(**vars)
 
 def main():
     ap = argparse.ArgumentParser()
@@ -25,17 +81,29 @@ def main():
     ap.add_argument("--model_path", required=True, help="Path to GGUF model")
     ap.add_argument("--n_gpu_layers", type=int, default=0)
     ap.add_argument("--n_ctx", type=int, default=8192)
+    ap.add_argument("--n_batch", type=int, default=2048, help="Prompt tokens evaluated per batch")
+    ap.add_argument("--n_threads", type=int, default=os.cpu_count())
     ap.add_argument("--max_tokens", type=int, default=768)
     ap.add_argument("--temperature", type=float, default=0.2)
     ap.add_argument("--top_p", type=float, default=0.9)
     ap.add_argument("--outdir", default="data/generations")
+    ap.add_argument("--no_resume", action="store_true",
+                    help="Regenerate cases already present in the output file")
     args = ap.parse_args()
 
     prompts = yaml.safe_load(open(args.prompts, "r", encoding="utf-8"))
     outdir = Path(args.outdir); outdir.mkdir(parents=True, exist_ok=True)
     out_path = outdir / (Path(args.model_path).stem + ".jsonl")
+    trim_partial_line(out_path)
+    done = set() if args.no_resume else load_done(out_path)
+    config = {"max_tokens": args.max_tokens, "temperature": args.temperature, "top_p": args.top_p}
 
-    llm = Llama(model_path=args.model_path, n_ctx=args.n_ctx, n_gpu_layers=args.n_gpu_layers, verbose=False)
+    # Large n_batch parallelizes prompt ingestion (long code excerpts). The shared
+    # case prefix is not re-evaluated across templates: Llama keeps the previous
+    # tokens and only evaluates what follows the longest common prefix.
+    llm = Llama(model_path=args.model_path, n_ctx=args.n_ctx, n_gpu_layers=args.n_gpu_layers,
+                n_batch=min(args.n_batch, args.n_ctx), n_threads=args.n_threads,
+                n_threads_batch=args.n_threads, use_mmap=True, use_mlock=False, verbose=False)
 
     def chat(prompt):
         t0=time.time()
@@ -55,7 +123,7 @@ def main():
         tokens_out = out.get("usage",{}).get("completion_tokens")
         return text, t, tokens_in, tokens_out
 
-    with open(out_path, "a", encoding="utf-8") as fout:
+    with open(out_path, "ab") as fout:
         for case in read_cases(Path(args.cases)):
             vars = {
               "smell_type": case["smell_type"],
@@ -73,22 +141,26 @@ def main():
               "FANIN": (case.get("metrics", {}) or {}).get("FANIN", ""),
               "FANOUT": (case.get("metrics", {}) or {}).get("FANOUT", "")
             }
-            ph = sha1(json.dumps(vars, sort_keys=True))
+            keys = ["explain_template","refactor_template","meta_validation_template"]
+            user_prompts = [render_prompt(prompts, key, vars) for key in keys]
+            ph = prompt_hash(user_prompts, {"system": prompts["system"], **config})
+            if (case["case_id"], ph) in done:
+                continue
             rec = {
               "case_id": case["case_id"],
               "model": str(Path(args.model_path).name),
               "prompt_hash": ph,
-              "config": {"max_tokens": args.max_tokens, "temperature": args.temperature, "top_p": args.top_p}
+              "config": config
             }
-            for key in ["explain_template","refactor_template","meta_validation_template"]:
-                text, dur, tin, tout = chat(prompts[key].format(**vars))
+            for key, prompt in zip(keys, user_prompts):
+                text, dur, tin, tout = chat(prompt)
                 rec[key.replace("_template","")] = {
                     "text": text,
                     "latency_s": round(dur,2),
                     "tokens_in": tin,
                     "tokens_out": tout
                 }
-            fout.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            fout.write(orjson.dumps(rec, option=orjson.OPT_APPEND_NEWLINE))
     print(f"Wrote generations to {out_path}")
 
 if __name__ == "__main__":
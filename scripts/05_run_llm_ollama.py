@@ -11,20 +11,73 @@ Example:
     --prompts configs/prompts.yaml \
     --outdir data/generations
 """
-import argparse, json, time, requests, yaml, hashlib
+import argparse, asyncio, time, httpx, orjson, yaml, xxhash
 from pathlib import Path
 
-def sha1(x: str) -> str:
-    return hashlib.sha1(x.encode()).hexdigest()[:10]
+def prompt_hash(rendered: list[str], settings: dict) -> str:
+    # Cache key over the exact request (system text, prompt text, sampling settings),
+    # so changing any of them regenerates the case on resume.
+    h = xxhash.xxh3_64(orjson.dumps(settings, option=orjson.OPT_SORT_KEYS))
+    for p in rendered:
+        h.update(p.encode())
+    return h.hexdigest()[:10]
 
 def read_cases(path: Path):
-    with open(path, "r", encoding="utf-8") as f:
+    with open(path, "rb") as f:
         for line in f:
             if line.strip():
-                yield json.loads(line)
+                yield orjson.loads(line)
 
-def generate_ollama(model: str, prompt: str, system: str,
-                    temperature: float, top_p: float, max_tokens: int):
+def load_done(out_path: Path) -> set:
+    # (case_id, prompt_hash) pairs already in the output; a rerun only does what is missing
+    done = set()
+    if out_path.exists():
+        with out_path.open("rb") as f:
+            for line in f:
+                try:
+                    rec = orjson.loads(line)
+                except orjson.JSONDecodeError:   # blank or truncated line from an interrupted run
+                    continue
+                done.add((rec["case_id"], rec.get("prompt_hash")))
+    return done
+
+def trim_partial_line(out_path: Path) -> None:
+    # An interrupted run can leave a half-written last record; cut it back to the
+    # last newline so the next append starts on a fresh line. A complete record
+    # that only lacks its newline (e.g. a hand-concatenated file) is kept.
+    if not out_path.exists():
+        return
+    with out_path.open("r+b") as f:
+        end = f.seek(0, 2)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - (1 << 16))
+            f.seek(start)
+            chunk = f.read(pos - start)
+            nl = chunk.rfind(b"\n")
+            if nl >= 0:
+                pos = start + nl + 1
+                break
+            pos = start
+        if pos == end:
+            return
+        f.seek(pos)
+        try:
+            orjson.loads(f.read())
+        except orjson.JSONDecodeError:
+            f.truncate(pos)
+        else:
+            f.write(b"\n")
+
+def render_prompt(prompts: dict, key: str, vars: dict) -> str:
+    # Shared case context first, task text last: the templates of a case then
+    # share a prompt prefix the server can cache (see context_template in prompts.yaml).
+    context = prompts.get("context_template")
+    template = f"{context}\n{prompts[key]}" if context else prompts[key]
+    return template.format(**vars)
+
+async def generate_ollama(client: httpx.AsyncClient, model: str, prompt: str, system: str,
+                          temperature: float, top_p: float, max_tokens: int):
     url = "http://localhost:11434/api/generate"
     payload = {
         "model": model,
@@ -37,7 +90,7 @@ def generate_ollama(model: str, prompt: str, system: str,
         "stream": False,
     }
     t0 = time.time()
-    resp = requests.post(url, json=payload, timeout=600)
+    resp = await client.post(url, json=payload)
     resp.raise_for_status()
     data = resp.json()
     text = data.get("response", "")
@@ -53,6 +106,10 @@ def main():
     ap.add_argument("--top_p", type=float, default=0.9)
     ap.add_argument("--max_tokens", type=int, default=768)
     ap.add_argument("--outdir", default="data/generations")
+    ap.add_argument("--concurrency", type=int, default=4,
+                    help="Max in-flight requests (match the server's OLLAMA_NUM_PARALLEL)")
+    ap.add_argument("--no_resume", action="store_true",
+                    help="Regenerate cases already present in the output file")
     args = ap.parse_args()
 
     prompts = yaml.safe_load(open(args.prompts, "r", encoding="utf-8"))
@@ -60,42 +117,68 @@ def main():
     cases_path = Path(args.cases)
     outdir = Path(args.outdir); outdir.mkdir(parents=True, exist_ok=True)
     out_path = outdir / f"{args.model}_ollama.jsonl"
+    trim_partial_line(out_path)
+    done = set() if args.no_resume else load_done(out_path)
+    settings = {"system": system, "max_tokens": args.max_tokens, "temperature": args.temperature,
+                "top_p": args.top_p}
 
-    with open(out_path, "a", encoding="utf-8") as fout:
-        for case in read_cases(cases_path):
-            metrics = case.get("metrics", {}) or {}
-            vars = {
-                "smell_type": case["smell_type"],
-                "detector_reason": case["detector_reason"],
-                "code_excerpt": case["code_excerpt"],
-                "problem_bullets": case["detector_reason"],
-                "NOF": metrics.get("NOF", ""),
-                "NOPF": metrics.get("NOPF", ""),
-                "NOM": metrics.get("NOM", ""),
-                "NOPM": metrics.get("NOPM", ""),
-                "LOC": metrics.get("LOC", ""),
-                "WMC": metrics.get("WMC", ""),
-                "DIT": metrics.get("DIT", ""),
-                "LCOM": metrics.get("LCOM", ""),
-                "FANIN": metrics.get("FANIN", ""),
-                "FANOUT": metrics.get("FANOUT", ""),
-            }
-            ph = sha1(json.dumps(vars, sort_keys=True))
-            record = {
-                "case_id": case["case_id"],
-                "file_path": case["file_path"],
-                "model": args.model,
-                "prompt_hash": ph,
+    async def run_case(client, sem, case):
+        metrics = case.get("metrics", {}) or {}
+        vars = {
+            "smell_type": case["smell_type"],
+            "detector_reason": case["detector_reason"],
+            "code_excerpt": case["code_excerpt"],
+            "problem_bullets": case["detector_reason"],
+            "NOF": metrics.get("NOF", ""),
+            "NOPF": metrics.get("NOPF", ""),
+            "NOM": metrics.get("NOM", ""),
+            "NOPM": metrics.get("NOPM", ""),
+            "LOC": metrics.get("LOC", ""),
+            "WMC": metrics.get("WMC", ""),
+            "DIT": metrics.get("DIT", ""),
+            "LCOM": metrics.get("LCOM", ""),
+            "FANIN": metrics.get("FANIN", ""),
+            "FANOUT": metrics.get("FANOUT", ""),
+        }
+        keys = ["explain_template","refactor_template","meta_validation_template"]
+        user_prompts = [render_prompt(prompts, key, vars) for key in keys]
+        ph = prompt_hash(user_prompts, settings)
+        if (case["case_id"], ph) in done:
+            return None
+        record = {
+            "case_id": case["case_id"],
+            "file_path": case["file_path"],
+            "model": args.model,
+            "prompt_hash": ph,
+        }
+
+        async def one(prompt):
+            async with sem:
+                return await generate_ollama(client, args.model, prompt, system,
+                                             args.temperature, args.top_p, args.max_tokens)
+
+        outs = await asyncio.gather(*(one(prompt) for prompt in user_prompts))
+        for key, (text, dur) in zip(keys, outs):
+            record[key.replace("_template","")] = {
+                "text": text,
+                "latency_s": dur,
             }
-            for key in ["explain_template","refactor_template","meta_validation_template"]:
-                prompt = prompts[key].format(**vars)
-                text, dur = generate_ollama(args.model, prompt, system,
-                                            args.temperature, args.top_p, args.max_tokens)
-                record[key.replace("_template","")] = {
-                    "text": text,
-                    "latency_s": dur,
-                }
-            fout.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return record
+
+    async def run():
+        # Queue every (case, template) request up front; the semaphore bounds how
+        # many are in flight at once.
+        sem = asyncio.Semaphore(args.concurrency)
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(timeout=600, limits=limits) as client:
+            tasks = [asyncio.create_task(run_case(client, sem, case)) for case in read_cases(cases_path)]
+            with open(out_path, "ab") as fout:
+                for fut in asyncio.as_completed(tasks):
+                    record = await fut
+                    if record is not None:
+                        fout.write(orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE))
+
+    asyncio.run(run())
     print(f"Wrote generations to {out_path}")
 
 if __name__ == "__main__":
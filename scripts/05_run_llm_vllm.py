@@ -3,29 +3,89 @@
 """
 Batch runner for open-source models served via vLLM's OpenAI-compatible API.
 Assumes a server is running, e.g.:
-  python -m vllm.entrypoints.openai.api_server --model <hf_model> --port 8000
+  python -m vllm.entrypoints.openai.api_server --model <hf_model> --port 8000 --enable-prefix-caching
 
 Inputs:
   - data/cases/cases.jsonl
   - prompts.yaml
 Outputs:
   - data/generations/<model_sanitized>.jsonl
+
+With --batch_templates, the three templates of a case are sent as one
+/v1/completions request with a list `prompt` (system text prepended, no chat
+template), which vLLM schedules together.
 """
-import argparse, json, os, time, hashlib
+import argparse, asyncio, os, time
 from pathlib import Path
 import yaml
-import requests
+import httpx
+import orjson
+import xxhash
 
-def sha1(x): return hashlib.sha1(x.encode()).hexdigest()[:10]
+def prompt_hash(rendered: list[str], settings: dict) -> str:
+    # Cache key over the exact request (system text, prompt text, sampling settings),
+    # so changing any of them regenerates the case on resume.
+    h = xxhash.xxh3_64(orjson.dumps(settings, option=orjson.OPT_SORT_KEYS))
+    for p in rendered:
+        h.update(p.encode())
+    return h.hexdigest()[:10]
 
 def sanitize(name: str) -> str:
     return name.replace("/", "_").replace(":", "_")
 
 def read_cases(p: Path):
-    with p.open() as f:
+    with p.open("rb") as f:
         for line in f:
             if line.strip():
-                yield json.loads(line)
+                yield orjson.loads(line)
+
+def load_done(out_path: Path) -> set:
+    # (case_id, prompt_hash) pairs already in the output; a rerun only does what is missing
+    done = set()
+    if out_path.exists():
+        with out_path.open("rb") as f:
+            for line in f:
+                try:
+                    rec = orjson.loads(line)
+                except orjson.JSONDecodeError:   # blank or truncated line from an interrupted run
+                    continue
+                done.add((rec["case_id"], rec.get("prompt_hash")))
+    return done
+
+def trim_partial_line(out_path: Path) -> None:
+    # An interrupted run can leave a half-written last record; cut it back to the
+    # last newline so the next append starts on a fresh line. A complete record
+    # that only lacks its newline (e.g. a hand-concatenated file) is kept.
+    if not out_path.exists():
+        return
+    with out_path.open("r+b") as f:
+        end = f.seek(0, 2)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - (1 << 16))
+            f.seek(start)
+            chunk = f.read(pos - start)
+            nl = chunk.rfind(b"\n")
+            if nl >= 0:
+                pos = start + nl + 1
+                break
+            pos = start
+        if pos == end:
+            return
+        f.seek(pos)
+        try:
+            orjson.loads(f.read())
+        except orjson.JSONDecodeError:
+            f.truncate(pos)
+        else:
+            f.write(b"\n")
+
+def render_prompt(prompts: dict, key: str, vars: dict) -> str:
+    # Shared case context first, task text last: the templates of a case then
+    # share a prompt prefix the server can cache (see context_template in prompts.yaml).
+    context = prompts.get("context_template")
+    template = f"{context}\n{prompts[key]}" if context else prompts[key]
+    return template.format(**vars)
 
 def main():
     ap = argparse.ArgumentParser()
@@ -33,72 +93,124 @@ def main():
     ap.add_argument("--prompts", default="prompts.yaml")
     ap.add_argument("--model", required=True, help="Model name as served by vLLM")
     ap.add_argument("--endpoint", default="http://localhost:8000/v1/chat/completions")
+    ap.add_argument("--completions_endpoint", default="http://localhost:8000/v1/completions")
+    ap.add_argument("--batch_templates", action="store_true",
+                    help="Send all templates of a case in one /v1/completions request")
     ap.add_argument("--max_tokens", type=int, default=768)
     ap.add_argument("--temperature", type=float, default=0.2)
     ap.add_argument("--top_p", type=float, default=0.9)
     ap.add_argument("--outdir", default="data/generations")
+    ap.add_argument("--concurrency", type=int, default=32,
+                    help="Max in-flight requests (match the server's --max-num-seqs; "
+                         "divide by 3 with --batch_templates)")
+    ap.add_argument("--no_resume", action="store_true",
+                    help="Regenerate cases already present in the output file")
     args = ap.parse_args()
 
     prompts = yaml.safe_load(open(args.prompts, "r", encoding="utf-8"))
     system = prompts["system"]
     outdir = Path(args.outdir); outdir.mkdir(parents=True, exist_ok=True)
     out_path = outdir / f"{sanitize(args.model)}.jsonl"
+    trim_partial_line(out_path)
+    done = set() if args.no_resume else load_done(out_path)
+    config = {"max_tokens": args.max_tokens, "temperature": args.temperature, "top_p": args.top_p,
+              "batch_templates": args.batch_templates}
 
-    def generate(prompt):
-        t0 = time.time()
-        resp = requests.post(args.endpoint, json={
-            "model": args.model,
-            "messages": [
-                {"role":"system","content": system},
-                {"role":"user","content": prompt}
-            ],
-            "temperature": args.temperature,
-            "top_p": args.top_p,
-            "max_tokens": args.max_tokens,
-            "seed": 42
-        }, timeout=600)
-        resp.raise_for_status()
-        j = resp.json()
+    async def generate(client, sem, prompt):
+        async with sem:
+            t0 = time.time()
+            resp = await client.post(args.endpoint, json={
+                "model": args.model,
+                "messages": [
+                    {"role":"system","content": system},
+                    {"role":"user","content": prompt}
+                ],
+                "temperature": args.temperature,
+                "top_p": args.top_p,
+                "max_tokens": args.max_tokens,
+                "seed": 42
+            })
+            resp.raise_for_status()
+            j = resp.json()
+            t = time.time() - t0
         text = j["choices"][0]["message"]["content"]
-        t = time.time() - t0
         tokens_in = j.get("usage",{}).get("prompt_tokens")
         tokens_out = j.get("usage",{}).get("completion_tokens")
         return text, t, tokens_in, tokens_out
 
-    with open(out_path, "a", encoding="utf-8") as fout:
-        for case in read_cases(Path(args.cases)):
-            vars = {
-              "smell_type": case["smell_type"],
-              "detector_reason": case["detector_reason"],
-              "code_excerpt": case["code_excerpt"],
-              "problem_bullets": case["detector_reason"],
-              "NOF": (case.get("metrics", {}) or {}).get("NOF", ""),
-              "NOPF": (case.get("metrics", {}) or {}).get("NOPF", ""),
-              "NOM": (case.get("metrics", {}) or {}).get("NOM", ""),
-              "NOPM": (case.get("metrics", {}) or {}).get("NOPM", ""),
-              "LOC": (case.get("metrics", {}) or {}).get("LOC", ""),
-              "WMC": (case.get("metrics", {}) or {}).get("WMC", ""),
-              "DIT": (case.get("metrics", {}) or {}).get("DIT", ""),
-              "LCOM": (case.get("metrics", {}) or {}).get("LCOM", ""),
-              "FANIN": (case.get("metrics", {}) or {}).get("FANIN", ""),
-              "FANOUT": (case.get("metrics", {}) or {}).get("FANOUT", "")
-            }
-            ph = sha1(json.dumps(vars, sort_keys=True))
-            rec = {
-              "case_id": case["case_id"],
-              "model": args.model,
-              "prompt_hash": ph,
-              "config": {"max_tokens": args.max_tokens, "temperature": args.temperature, "top_p": args.top_p}
+    async def generate_batch(client, sem, prompt_list):
+        async with sem:
+            t0 = time.time()
+            resp = await client.post(args.completions_endpoint, json={
+                "model": args.model,
+                "prompt": [f"{system}\n\n{p}" for p in prompt_list],
+                "temperature": args.temperature,
+                "top_p": args.top_p,
+                "max_tokens": args.max_tokens,
+                "seed": 42
+            })
+            resp.raise_for_status()
+            j = resp.json()
+            t = time.time() - t0
+        # usage is reported for the whole bundle only, so per-template token counts are unknown
+        choices = sorted(j["choices"], key=lambda c: c["index"])
+        return [(c["text"], t, None, None) for c in choices]
+
+    async def run_case(client, sem, case):
+        vars = {
+          "smell_type": case["smell_type"],
+          "detector_reason": case["detector_reason"],
+          "code_excerpt": case["code_excerpt"],
+          "problem_bullets": case["detector_reason"],
+          "NOF": (case.get("metrics", {}) or {}).get("NOF", ""),
+          "NOPF": (case.get("metrics", {}) or {}).get("NOPF", ""),
+          "NOM": (case.get("metrics", {}) or {}).get("NOM", ""),
+          "NOPM": (case.get("metrics", {}) or {}).get("NOPM", ""),
+          "LOC": (case.get("metrics", {}) or {}).get("LOC", ""),
+          "WMC": (case.get("metrics", {}) or {}).get("WMC", ""),
+          "DIT": (case.get("metrics", {}) or {}).get("DIT", ""),
+          "LCOM": (case.get("metrics", {}) or {}).get("LCOM", ""),
+          "FANIN": (case.get("metrics", {}) or {}).get("FANIN", ""),
+          "FANOUT": (case.get("metrics", {}) or {}).get("FANOUT", "")
+        }
+        keys = ["explain_template","refactor_template","meta_validation_template"]
+        user_prompts = [render_prompt(prompts, key, vars) for key in keys]
+        ph = prompt_hash(user_prompts, {"system": system, **config})
+        if (case["case_id"], ph) in done:
+            return None
+        rec = {
+          "case_id": case["case_id"],
+          "model": args.model,
+          "prompt_hash": ph,
+          "config": config
+        }
+        if args.batch_templates:
+            outs = await generate_batch(client, sem, user_prompts)
+        else:
+            outs = await asyncio.gather(*(generate(client, sem, p) for p in user_prompts))
+        for key, (text, dur, tin, tout) in zip(keys, outs):
+            rec[key.replace("_template","")] = {
+                "text": text,
+                "latency_s": round(dur,2),
+                "tokens_in": tin,
+                "tokens_out": tout
             }
-            for key in ["explain_template","refactor_template","meta_validation_template"]:
-                text, dur, tin, tout = generate(prompts[key].format(**vars))
-                rec[key.replace("_template","")] = {
-                    "text": text,
-                    "latency_s": round(dur,2),
-                    "tokens_in": tin,
-                    "tokens_out": tout
-                }
-            fout.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        return rec
+
+    async def run():
+        # All (case, template) requests are queued up front; the semaphore keeps
+        # at most --concurrency in flight so the server can batch them.
+        sem = asyncio.Semaphore(args.concurrency)
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(timeout=600, limits=limits) as client:
+            tasks = [asyncio.create_task(run_case(client, sem, case)) for case in read_cases(Path(args.cases))]
+            with open(out_path, "ab") as fout:
+                for fut in asyncio.as_completed(tasks):
+                    rec = await fut
+                    if rec is not None:
+                        fout.write(orjson.dumps(rec, option=orjson.OPT_APPEND_NEWLINE))
+
+    asyncio.run(run())
     print(f"Wrote generations to {out_path}")
 
 if __name__ == "__main__":
@@ -13,10 +13,12 @@ Inputs:
   - data/generations/<model>.jsonl
 Outputs:
   - data/eval/auto_metrics.csv
+  - data/cases/.cases_v2.pkl   (per-case scoring cache, rebuilt when cases.jsonl changes)
 """
-import argparse, json, re
+import argparse, csv, functools, os, pickle, re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-import pandas as pd
+import orjson
 
 REFAC_TAXONOMY = {
     "Extract Class": [r"extract class", r"split class", r"move cluster of methods"],
@@ -32,6 +34,15 @@ REFAC_TAXONOMY = {
     "Strategy": [r"strategy pattern"],
     "Observer": [r"observer pattern"],
 }
+# Compiled once at import. The patterns are lowercase and run case-sensitively on
+# a lowered copy of the text: re.IGNORECASE prevents sre's literal-prefix search
+# and measured several times slower than one .lower() per text.
+_REFAC_RES = {label: [re.compile(p) for p in pats] for label, pats in REFAC_TAXONOMY.items()}
+
+# Texts shorter than this cannot contain any taxonomy phrase. The shortest
+# patterns match 6 characters: "facade" and "getter|setter". Update this when
+# adding shorter patterns.
+_MIN_TAXO_LEN = 6
 
 SMELL_CUES = {
     "deficient encapsulation": ["public field", "exposes field", "mutable state", "information hiding"],
@@ -45,106 +56,191 @@ SMELL_CUES = {
 PRINCIPLES = ["single responsibility", "open-closed", "dependency inversion", "liskov", "interface segregation",
               "law of demeter", "cohesion", "coupling", "encapsulation", "polymorphism"]
 
-IDENT_PAT = re.compile(r"\b[A-Za-z_][A-Za-z0-9_]*\b")
-
-def keyword_score(smell_type: str, reason: str, explanation: str) -> float:
-    cues = set()
+@functools.lru_cache(maxsize=None)
+def smell_cues(smell_type: str) -> frozenset[str]:
+    # few distinct smell types: resolve each one's cue set once, not per row
     st = smell_type.lower()
-    for k,v in SMELL_CUES.items():
-        if k in st:
-            cues.update(v)
-    # add words from reason
-    for w in re.findall(r"[A-Za-z]{4,}", reason.lower()):
-        if w in {"this","because","that","class","following","fields","methods","smell","detected"}:
-            continue
-        cues.add(w)
-    if not cues:
+    return frozenset(c for k, v in SMELL_CUES.items() if k in st for c in v)
+
+# one alternation scan instead of a substring test (and a .lower()) per principle
+_PRINCIPLES_RE = re.compile("|".join(re.escape(p) for p in PRINCIPLES))
+
+IDENT_PAT = re.compile(r"\b[A-Za-z_][A-Za-z0-9_]*\b")
+# common english/Java words that are not hallucinated identifiers (tiny stoplist, lowercase)
+STOP = frozenset({"the","and","for","with","this","that","from","class","method","field","public","private","protected","return","new","null","true","false"})
+_JUST_RE = re.compile(r"(because|due to|therefore).*(cohesion|coupling|encapsulation|responsibilit)")
+_BULLET_RE = re.compile(r"^(\s*[-*]|\s*\d+\.)", re.M)
+_WORD_RE = re.compile(r"[A-Za-z]{4,}")
+_REASON_STOP = frozenset({"this","because","that","class","following","fields","methods","smell","detected"})
+
+def case_cues(smell_type: str, reason: str) -> frozenset[str]:
+    cues = set(smell_cues(smell_type))
+    # add words from reason, lowering one matched word at a time (not the whole reason)
+    for m in _WORD_RE.finditer(reason):
+        w = m.group(0).lower()
+        if w not in _REASON_STOP:
+            cues.add(w)
+    return frozenset(cues)
+
+def cue_score(cues: frozenset[str], explanation: str) -> float:
+    if not cues or not explanation:   # empty/failed generation: nothing can hit
         return 0.0
-    hits = sum(1 for c in cues if c in explanation.lower())
+    low = explanation.lower()   # once, not once per cue
+    hits = sum(1 for c in cues if c in low)
     return round(hits / len(cues), 3)
 
+def keyword_score(smell_type: str, reason: str, explanation: str) -> float:
+    return cue_score(case_cues(smell_type, reason), explanation)
+
 def principle_grounding(text: str) -> float:
-    mentions = [p for p in PRINCIPLES if p in text.lower()]
+    if not text:
+        return 0.0
+    low = text.lower()
+    mentions = 1 if _PRINCIPLES_RE.search(low) else 0
     # crude justification: presence of because/due to + a principle
-    just = 1 if re.search(r"(because|due to|therefore).*(cohesion|coupling|encapsulation|responsibilit)", text.lower()) else 0
-    return min(1.0, (len(mentions) > 0) * 0.5 + just * 0.5)
+    just = 1 if _JUST_RE.search(low) else 0
+    return min(1.0, mentions * 0.5 + just * 0.5)
 
 def tag_refactorings(text: str):
     hits = set()
-    for label, pats in REFAC_TAXONOMY.items():
-        if any(re.search(p, text.lower()) for p in pats):
+    low = text.lower()
+    if len(low) < _MIN_TAXO_LEN:   # skip ~25 regex searches that cannot match
+        return hits
+    for label, pats in _REFAC_RES.items():
+        if any(p.search(low) for p in pats):
             hits.add(label)
     return hits
 
-def identifiers_in(text: str):
-    return set([m.group(0) for m in IDENT_PAT.finditer(text)])
+def identifiers_in(text: str) -> set[str]:
+    return set(IDENT_PAT.findall(text))
 
-def identifier_hallucinations(snippet: str, commentary: str):
-    ids_snip = identifiers_in(snippet)
-    ids_comm = identifiers_in(commentary)
-    # filter out common english words (tiny stoplist)
-    stop = {"the","and","for","with","this","that","from","class","method","field","public","private","protected","return","new","null","true","false"}
-    ids_comm = {i for i in ids_comm if i.lower() not in stop}
-    extra = ids_comm - ids_snip
-    return sorted(list(extra))
+def identifier_hallucinations(ids_snip: set[str], commentary: str) -> set[str]:
+    # set difference first, so the stoplist filter only sees the extras
+    ids_comm = identifiers_in(commentary) - ids_snip
+    return {i for i in ids_comm if i.lower() not in STOP}
 
 def readability_score(text: str) -> int:
-    bullets = len(re.findall(r"^(\s*[-*]|\s*\d+\.)", text, re.M))
+    bullets = len(_BULLET_RE.findall(text))
     if bullets >= 6: return 3
     if bullets >= 3: return 2
     if bullets >= 1: return 1
     return 0
 
+CASES_CACHE_VERSION = 2   # bump when case_cues/identifiers_in change what gets cached
+
+def load_cases(path: Path) -> dict[str, dict]:
+    """
+    case_id -> {smell_type, cues, ids_snip}: everything the scorers need from a
+    case, with the reason cues and snippet identifiers precomputed.
+    Pickled next to the cases file and reused while the file (mtime/size) and
+    the cue configuration are unchanged, so warm runs skip JSON decoding and
+    snippet scans.
+    """
+    st = path.stat()
+    key = (st.st_mtime_ns, st.st_size, SMELL_CUES, _REASON_STOP)
+    cache = path.with_name(f".{path.stem}_v{CASES_CACHE_VERSION}.pkl")
+    try:
+        with cache.open("rb") as f:
+            if pickle.load(f) == key:
+                return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass   # missing or truncated cache: rebuild
+
+    cases = {}
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                j = orjson.loads(line)
+                cases[j["case_id"]] = {
+                    "smell_type": j["smell_type"],
+                    "cues": case_cues(j["smell_type"], j["detector_reason"]),
+                    "ids_snip": frozenset(identifiers_in(j["code_excerpt"])),
+                }
+    try:
+        with cache.open("wb") as f:
+            pickle.dump(key, f, protocol=5)   # header first: a stale cache is rejected without loading the rest
+            pickle.dump(cases, f, protocol=5)
+    except OSError:
+        pass   # read-only data dir: just run uncached
+    return cases
+
+FIELDS = ["case_id", "model", "smell_type", "detector_alignment", "principle_grounding",
+          "refactoring_coverage", "specificity_ids", "hallucinations_count", "readability"]
+
+_CASES = {}
+
+def init_worker(cases: dict[str, dict]) -> None:
+    # runs once per worker process, so the cases dict is shipped once, not per row
+    global _CASES
+    _CASES = cases
+
+def score_line(line: bytes) -> dict | None:
+    """Scores one generation record against its case; None if the case is unknown."""
+    g = orjson.loads(line)
+    c = _CASES.get(g["case_id"])
+    if not c:
+        return None
+    exp = g["explain"]["text"]
+    ref = g["refactor"]["text"]
+    combined = exp + "\n" + ref
+    align = cue_score(c["cues"], exp)
+    grounding = principle_grounding(exp)
+    ref_hits = tag_refactorings(ref)
+    coverage = len(ref_hits)
+    # specificity: count of identifiers mentioned that exist in snippet
+    ids_snip = c["ids_snip"]
+    ids_ref = identifiers_in(ref)
+    specificity = len(ids_ref & ids_snip)
+    halluc = identifier_hallucinations(ids_snip, combined)
+    read = readability_score(ref)
+    return {
+        "case_id": g["case_id"],
+        "model": g["model"],
+        "smell_type": c["smell_type"],
+        "detector_alignment": align,
+        "principle_grounding": grounding,
+        "refactoring_coverage": coverage,
+        "specificity_ids": specificity,
+        "hallucinations_count": len(halluc),
+        "readability": read
+    }
+
+def write_rows(writer: csv.DictWriter, scored) -> int:
+    n = 0
+    for row in scored:
+        if row is not None:   # generation without a known case
+            writer.writerow(row)
+            n += 1
+    return n
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--cases", default="data/cases/cases.jsonl")
     ap.add_argument("--generations", required=True, help="Path to generations jsonl")
     ap.add_argument("--out", default="data/eval/auto_metrics.csv")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                    help="Worker processes for scoring (1 = run in-process)")
     args = ap.parse_args()
 
     Path(args.out).parent.mkdir(parents=True, exist_ok=True)
 
-    cases = {}
-    with open(args.cases, "r", encoding="utf-8") as f:
-        for line in f:
-            if line.strip():
-                j = json.loads(line)
-                cases[j["case_id"]] = j
-
-    rows = []
-    with open(args.generations, "r", encoding="utf-8") as f:
-        for line in f:
-            if not line.strip(): continue
-            g = json.loads(line)
-            c = cases.get(g["case_id"])
-            if not c: 
-                continue
-            exp = g["explain"]["text"]
-            ref = g["refactor"]["text"]
-            combined = exp + "\n" + ref
-            align = keyword_score(c["smell_type"], c["detector_reason"], exp)
-            grounding = principle_grounding(exp)
-            ref_hits = tag_refactorings(ref)
-            coverage = len(ref_hits)
-            # specificity: count of identifiers mentioned that exist in snippet
-            ids_snip = identifiers_in(c["code_excerpt"])
-            ids_ref = identifiers_in(ref)
-            specificity = len(ids_ref & ids_snip)
-            halluc = identifier_hallucinations(c["code_excerpt"], combined)
-            read = readability_score(ref)
-            rows.append({
-                "case_id": g["case_id"],
-                "model": g["model"],
-                "smell_type": c["smell_type"],
-                "detector_alignment": align,
-                "principle_grounding": grounding,
-                "refactoring_coverage": coverage,
-                "specificity_ids": specificity,
-                "hallucinations_count": len(halluc),
-                "readability": read
-            })
-    pd.DataFrame(rows).to_csv(args.out, index=False)
-    print(f"Wrote {len(rows)} rows to {args.out}")
+    cases = load_cases(Path(args.cases))
+
+    with open(args.generations, "rb") as f:
+        lines = [line for line in f if line.strip()]
+
+    # Rows are independent and CPU-bound: fan them out, keeping input order,
+    # and stream each scored row straight to the CSV (fixed schema, no DataFrame)
+    with open(args.out, "w", encoding="utf-8", newline="") as fout:
+        writer = csv.DictWriter(fout, fieldnames=FIELDS, lineterminator="\n")
+        writer.writeheader()
+        if args.workers > 1 and len(lines) > 1:
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(cases,)) as ex:
+                n = write_rows(writer, ex.map(score_line, lines, chunksize=64))
+        else:
+            init_worker(cases)
+            n = write_rows(writer, map(score_line, lines))
+    print(f"Wrote {n} rows to {args.out}")
 
 if __name__ == "__main__":
     main()
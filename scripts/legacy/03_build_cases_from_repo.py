@@ -3,7 +3,7 @@
 """
 Build LLM-ready cases by resolving Java source files from package + class, then extracting a focused code excerpt.
 Inputs:
-  data/interim/smells.csv (from parse_designite_csv.py)
+  data/interim/smells.parquet (from parse_designite_csv.py; the --debug smells.csv also works)
   --repo_dir path to K-9 source root (contains app/src/...)
 Outputs:
   data/cases/cases.jsonl
@@ -12,14 +12,55 @@ Strategy:
   - If inner class present (A.B), search for 'class B' region inside the file to focus excerpt.
   - Heuristics by smell type to select relevant lines (public fields for Deficient Encapsulation, etc.).
 """
-import argparse, json, os, re
+import argparse, bisect, csv, functools, itertools, json, os, re
 from pathlib import Path
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 
-def find_java_file(repo_dir: Path, package: str, outer_class: str) -> Path | None:
-    rel = Path(*package.split(".")) / f"{outer_class}.java"
-    candidates = list(repo_dir.rglob(str(rel)))
-    return candidates[0] if candidates else None
+def build_java_index(repo_dir: Path) -> dict[tuple[str, str], Path]:
+    """
+    One os.walk of the repo instead of an rglob("<pkg/path>/<Outer>.java") per
+    smell row. Every trailing run of directory names is indexed as a candidate
+    package, mapping (package, outer_class) -> .java file. On duplicates the
+    rglob's first hit is kept: it lists hits by the directory the package path
+    hangs off (dirs[:i]), so one rooted above another wins, else walk order.
+    """
+    best = {}
+    for dirpath, _, filenames in os.walk(repo_dir):
+        rel = os.path.relpath(dirpath, repo_dir)
+        dirs = () if rel == os.curdir else tuple(rel.split(os.sep))
+        for fn in filenames:
+            if not fn.endswith(".java"):
+                continue
+            stem, path = os.path.splitext(fn)[0], None
+            for i in range(len(dirs) + 1):
+                key = (".".join(dirs[i:]), stem)
+                prev = best.get(key)
+                if prev is None or (i < prev[0] and prev[1][:i] == dirs[:i]):
+                    path = path or Path(dirpath, fn)   # a Path only for files that get indexed
+                    best[key] = (i, dirs, path)
+    return {key: p for key, (_, _, p) in best.items()}
+
+def read_smells_records(path: str) -> tuple[list[str], list[dict]]:
+    """
+    Parquet or all-string CSV read via pyarrow; rows come back as plain dicts
+    (no per-row Series as with iterrows). Empty cells stay "" rather than NaN,
+    in Parquet too, so both inputs give the same cases.
+    """
+    if path.endswith(".parquet"):
+        table = pq.read_table(path)
+        for i, field in enumerate(table.schema):
+            if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+                table = table.set_column(i, field.name, pc.fill_null(table.column(i), ""))
+        return table.column_names, table.to_pylist()
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        names = next(csv.reader(f))
+    table = pacsv.read_csv(path, convert_options=pacsv.ConvertOptions(
+        column_types={n: pa.string() for n in names}))
+    return table.column_names, table.to_pylist()
 
 def read_text(p: Path) -> str:
     try:
@@ -27,19 +68,55 @@ def read_text(p: Path) -> str:
     except Exception:
         return p.read_text(encoding="latin-1")
 
+def line_table(text: str) -> tuple[list[str], list[int]]:
+    """Lines (as splitlines) plus each line's start offset in text."""
+    lines = text.splitlines()
+    starts = list(itertools.accumulate((len(l) for l in text.splitlines(keepends=True)), initial=0))
+    return lines, starts
+
+@functools.lru_cache(maxsize=1024)
+def load_source(path: str) -> tuple[str, list[str], list[int]]:
+    # Several smells usually point at the same file; read/decode/split it once.
+    text = read_text(Path(path))
+    return (text, *line_table(text))
+
+@functools.lru_cache(maxsize=4096)
+def inner_header_re(inner_name: str) -> re.Pattern:
+    return re.compile(rf"\b(class|interface|enum)\s+{re.escape(inner_name)}\b")
+
 def slice_inner_class(text: str, inner: str | None) -> str:
     if not inner or inner == "":
         return text
     # inner might be A.B.C; take last
     inner_name = inner.split(".")[-1]
-    pat = re.compile(rf"\b(class|interface|enum)\s+{re.escape(inner_name)}\b[\s\S]*?\n\}}", re.M)
-    m = pat.search(text)
-    return m.group(0) if m else text
+    # From the header up to the first "\n}" after it. Same span as the old lazy
+    # [\s\S]*?\n\} regex, but found with str.find: no backtracking re-scan
+    # per header candidate when the file has no closer.
+    m = inner_header_re(inner_name).search(text)
+    if not m:
+        return text
+    end = text.find("\n}", m.end())
+    return text[m.start():end + 2] if end != -1 else text
 
-def heuristic_excerpt(text: str, smell: str, loc_limit: int = 400) -> str:
-    lines = text.splitlines()
+# Heuristic patterns run once over the whole text (not once per line). Their
+# whitespace is \s minus the line breaks splitlines() splits on, so a match
+# never spans two of the lines it is mapped back to.
+_HS = r"[^\S\n\r\x0b\x0c\x1c-\x1e\x85\u2028\u2029]"
+_PUB_FIELD_RE = re.compile(rf"\bpublic{_HS}+(static{_HS}+)?(final{_HS}+)?[\w\<\>\[\]]+{_HS}+\w+{_HS}*(=|;)")
+_ANY_FIELD_RE = re.compile(rf"\b(private|protected|public){_HS}+(static{_HS}+)?(final{_HS}+)?[\w\<\>\[\]]+{_HS}+\w+{_HS}*(=|;)")
+_CLASS_HDR_RE = re.compile(r"\b(class|interface|enum)\b")
+
+def matching_lines(pat: re.Pattern, text: str, line_starts: list[int]) -> list[int]:
+    # indices of the lines containing a match, ascending, each once
+    return list(dict.fromkeys(bisect.bisect_right(line_starts, m.start()) - 1 for m in pat.finditer(text)))
+
+def heuristic_excerpt(text: str, smell: str, loc_limit: int = 400,
+                      lines: list[str] | None = None, line_starts: list[int] | None = None) -> str:
+    # `lines`/`line_starts` may be passed in precomputed (see load_source)
+    if lines is None or line_starts is None:
+        lines, line_starts = line_table(text)
     if smell.lower().startswith("deficient encapsulation"):
-        sel = [i for i,l in enumerate(lines) if re.search(r"\bpublic\s+(static\s+)?(final\s+)?[\w\<\>\[\]]+\s+\w+\s*(=|;)", l)]
+        sel = matching_lines(_PUB_FIELD_RE, text, line_starts)
         window = []
         for idx in sel:
             window.extend(range(max(0,idx-3), min(len(lines), idx+4)))
@@ -47,8 +124,9 @@ def heuristic_excerpt(text: str, smell: str, loc_limit: int = 400) -> str:
         chosen = [lines[i] for i in window]
     elif smell.lower().startswith("unnecessary abstraction") or smell.lower().startswith("unutilized abstraction"):
         # show class header + fields (no methods)
-        header_idx = next((i for i,l in enumerate(lines) if re.search(r"\b(class|interface|enum)\b", l)), 0)
-        fields = [l for l in lines if re.search(r"\b(private|protected|public)\s+(static\s+)?(final\s+)?[\w\<\>\[\]]+\s+\w+\s*(=|;)", l)]
+        m = _CLASS_HDR_RE.search(text)
+        header_idx = bisect.bisect_right(line_starts, m.start()) - 1 if m else 0
+        fields = [lines[i] for i in matching_lines(_ANY_FIELD_RE, text, line_starts)]
         chosen = lines[header_idx:header_idx+30] + fields[:40]
     else:
         # fallback: take first class block up to limit
@@ -59,14 +137,14 @@ def heuristic_excerpt(text: str, smell: str, loc_limit: int = 400) -> str:
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--smells_csv", default="data/interim/smells.csv")
+    ap.add_argument("--smells", "--smells_csv", dest="smells", default="data/interim/smells.parquet")
     ap.add_argument("--metrics_csv", default=None)
     ap.add_argument("--repo_dir", required=True)
     ap.add_argument("--out", default="data/cases/cases.jsonl")
     ap.add_argument("--loc_limit", type=int, default=400)
     args = ap.parse_args()
 
-    df = pd.read_csv(args.smells_csv, dtype=str)
+    columns, records = read_smells_records(args.smells)
     metrics_df = None
     if args.metrics_csv:
         try:
@@ -74,17 +152,35 @@ def main():
         except Exception:
             pass
     repo_dir = Path(args.repo_dir)
+    java_index = build_java_index(repo_dir)
+
+    # Index the metrics rows by (project, package, type) once; the per-smell
+    # lookup is then O(1) instead of a three-column mask over the whole table
+    metrics_index = {}
+    if metrics_df is not None and all(k in columns for k in ["project","package","class_name"]):
+        # try to align columns names
+        cols = {c.lower(): c for c in metrics_df.columns}
+        pn = cols.get("project name", None)
+        pk = cols.get("package name", None)
+        tn = cols.get("type name", None)
+        if pn and pk and tn:
+            for row in metrics_df.to_dict("records"):
+                key = (row.pop(pn), row.pop(pk), row.pop(tn))
+                metrics_index.setdefault(key, row)   # first match wins, as .head(1) did
 
     out_path = Path(args.out); out_path.parent.mkdir(parents=True, exist_ok=True)
     n_written = 0
     with open(out_path, "w", encoding="utf-8") as fout:
-        for _, r in df.iterrows():
-            java_path = find_java_file(repo_dir, r["package"], r["outer_class"])
+        for r in records:
+            java_path = java_index.get((r["package"], r["outer_class"]))
             if not java_path or not java_path.exists():
                 continue
-            code = read_text(java_path)
-            code = slice_inner_class(code, r.get("inner_class"))
-            excerpt = heuristic_excerpt(code, r["smell_type"], args.loc_limit)
+            code, lines, line_starts = load_source(str(java_path))
+            part = slice_inner_class(code, r.get("inner_class"))
+            if part is code:   # no inner class slice: reuse the cached split
+                excerpt = heuristic_excerpt(code, r["smell_type"], args.loc_limit, lines, line_starts)
+            else:
+                excerpt = heuristic_excerpt(part, r["smell_type"], args.loc_limit)
             # attach metrics if available (either via merged smells CSV or separate metrics file)
             metrics_payload = r.get("metrics","{}")
             try:
@@ -93,23 +189,10 @@ def main():
             except Exception:
                 _m = {}
             # If separate metrics CSV is supplied and has matching row (by class/package/project), add columns
-            if metrics_df is not None:
-                try:
-                    key_cols = ["project","package","class_name"]
-                    # ensure we have canonical names in df
-                    if all(k in df.columns for k in key_cols):
-                        sub = metrics_df
-                        # try to align columns names
-                        cols = {c.lower(): c for c in metrics_df.columns}
-                        pn = cols.get("project name", None)
-                        pk = cols.get("package name", None)
-                        tn = cols.get("type name", None)
-                        if pn and pk and tn:
-                            rowm = metrics_df[(metrics_df[pn]==r["project"]) & (metrics_df[pk]==r["package"]) & (metrics_df[tn]==r["class_name"])].head(1)
-                            if len(rowm)==1:
-                                _m.update({k: rowm.iloc[0][k] for k in rowm.columns if k not in (pn,pk,tn)})
-                except Exception:
-                    pass
+            if metrics_index:
+                rowm = metrics_index.get((r["project"], r["package"], r["class_name"]))
+                if rowm is not None and isinstance(_m, dict):
+                    _m.update(rowm)
             obj = {
                 "case_id": r["case_id"],
                 "project": r["project"],
@@ -18,8 +18,11 @@ Contents:
     <text>
 """
 
-import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import orjson
 
 # Input path: update if needed
 GEN_PATH = Path("data/generations/llama3.1:8b_ollama.jsonl")
@@ -29,9 +32,25 @@ OUT_DIR = Path("md_out")
 OUT_DIR.mkdir(exist_ok=True)
 
 
+# anything but letters, numbers, dash, underscore (Unicode \w is isalnum() plus "_")
+_CLEAN_RE = re.compile(r"[^\w-]+")
+
+
 def clean_filename(text: str) -> str:
-    # keep letters, numbers, dash, underscore
-    return "".join(c for c in text if c.isalnum() or c in "-_").strip("_")
+    return _CLEAN_RE.sub("", text).strip("_")
+
+
+def write_page(out_path: Path, case_id, explain, refactor, meta) -> None:
+    # Section by section into one binary handle: the page is never built as a
+    # single str and then encoded again as a whole.
+    with out_path.open("wb") as f:
+        f.write(f"# Case {case_id}\n\n## Explanation\n".encode("utf-8"))
+        f.write(str(explain).encode("utf-8"))
+        f.write(b"\n\n## Refactoring Plan\n")
+        f.write(str(refactor).encode("utf-8"))
+        f.write(b"\n\n## Meta Validation\n")
+        f.write(str(meta).encode("utf-8"))
+        f.write(b"\n")
 
 
 def main():
@@ -39,13 +58,18 @@ def main():
         raise SystemExit(f"File not found: {GEN_PATH}")
 
     index_entries = []
+    # Many small files: overlap the open/write/close syscalls on a thread pool
+    # (the GIL is released while writing). Pages are submitted as they are read;
+    # the semaphore caps how many wait in the queue, so records are not all held.
+    pending = {}   # out_path -> its latest write
+    slots = threading.BoundedSemaphore(256)
 
-    with GEN_PATH.open("r", encoding="utf-8") as f:
+    with GEN_PATH.open("rb") as f, ThreadPoolExecutor(max_workers=32) as ex:
         for line in f:
             if not line.strip():
                 continue
 
-            rec = json.loads(line)
+            rec = orjson.loads(line)   # bytes straight in, no str decode
 
             case_id = rec.get("case_id", "unknown")
             safe_id = clean_filename(str(case_id))
@@ -54,27 +78,23 @@ def main():
             refactor = rec.get("refactor", {}).get("text", "")
             meta = rec.get("meta_validation", {}).get("text", "")
 
-            md_text = f"""# Case {case_id}
-
-## Explanation
-{explain}
-
-## Refactoring Plan
-{refactor}
-
-## Meta Validation
-{meta}
-"""
-
             out_path = OUT_DIR / f"case_{safe_id}.md"
-            out_path.write_text(md_text, encoding="utf-8")
+            prev = pending.get(out_path)
+            if prev is not None:
+                prev.result()   # repeated case_id: write in order, so its last record wins as before
+            slots.acquire()
+            fut = ex.submit(write_page, out_path, case_id, explain, refactor, meta)
+            fut.add_done_callback(lambda _: slots.release())
+            pending[out_path] = fut
 
             index_entries.append(f"- [Case {case_id}](case_{safe_id}.md)")
 
+    for fut in pending.values():
+        fut.result()   # re-raise any write error
+
     # Optional: write summary index file
-    (OUT_DIR / "INDEX.md").write_text(
-        "# Index of Cases\n\n" + "\n".join(index_entries),
-        encoding="utf-8",
+    (OUT_DIR / "INDEX.md").write_bytes(
+        ("# Index of Cases\n\n" + "\n".join(index_entries)).encode("utf-8")
     )
 
     print(f"Done. Markdown files saved in: {OUT_DIR.resolve()}")